@@ -1,85 +1,168 @@
 import os
 import time
+import shutil
+import zlib
 import sqlite3
-from queue import Queue, Empty
-from threading import Thread
-from datetime import datetime
+from queue import Queue, Empty, Full
+from threading import Thread, Lock, local
+from collections import deque
+from datetime import datetime, timedelta
 from functools import lru_cache
+from contextlib import contextmanager
+from concurrent.futures import Future
 from werkzeug.utils import secure_filename
 from flask import Flask, render_template, request, jsonify
 from flask_compress import Compress
 from flask_socketio import SocketIO, emit
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 DB_PATH = os.path.join(BASE_DIR, "detections.db")
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 512 * 1024 * 1024))
+UPLOAD_CHUNK = 1 << 20
+# e.g. redis://localhost:6379/0, so emits reach clients of every gunicorn worker
+SOCKETIO_MESSAGE_QUEUE = os.environ.get("SOCKETIO_MESSAGE_QUEUE")
 
-DB_POOL_MAX = 5
+HISTORY_LIMIT = 50
 BACKGROUND_WORKERS = 3
+WRITER_BATCH_MAX = 128
+WRITER_BATCH_WINDOW = 0.02
+# record_detections() gives up on db_writer() after this many seconds
+WRITER_RESULT_TIMEOUT = 5.0
+EMIT_BATCH_MAX = 10
+EMIT_BATCH_WINDOW = 0.5
+VIDEO_SIM_DETECTIONS = 4
 TASK_QUEUE = Queue()
-DB_POOL = Queue(maxsize=DB_POOL_MAX)
+DETECTION_QUEUE = Queue()
+EMIT_QUEUE = Queue(maxsize=2000)
+# one lazily opened query-only connection per thread, see read_db()
+_read_local = local()
 
 app = Flask(__name__, template_folder="Frontend-Files/templates", static_folder="Frontend-Files/static")
 app.config['UPLOAD_FOLDER'] = UPLOAD_DIR
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode="eventlet")
+# checked against Content-Length before the body is read: 413 without any file I/O
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode="threading", message_queue=SOCKETIO_MESSAGE_QUEUE)
 Compress(app)
 
 settings = {"threshold": 2.0, "alerts_enabled": True}
 camera_active = False
 
-def _create_conn():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+# published by db_writer() after each commit, seeded at startup. They are per process:
+# with several worker processes each one only adds the rows it wrote itself, so run a
+# single process (with threads) when /stats and the newest /history page must be exact
+_counters_lock = Lock()
+_total_detections = 0
+_last_detection_id = 0
+# bumped by db_writer() after each committed batch; part of every DB-backed cache key
+_cache_version = 0
+_recent_detections = deque(maxlen=HISTORY_LIMIT)
+
+DB_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA busy_timeout=5000",
+)
+
+INSERT_DETECTIONS_SQL = "INSERT INTO detections (ts, obj_type, distance) VALUES (?, ?, ?)"
+HISTORY_PAGE_SQL = "SELECT id, ts, obj_type, distance FROM detections WHERE id < ? ORDER BY id DESC LIMIT ?"
+
+class _Connection(sqlite3.Connection):
+    # one long-lived cursor per connection; the statement cache is keyed on SQL text
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cur = self.cursor()
+
+def _create_conn(read_only=False):
+    # autocommit; journal_mode=WAL is persisted in the db file by initialize_db_pool()
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None,
+                           factory=_Connection, cached_statements=256)
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    if read_only:
+        conn.execute("PRAGMA query_only=ON")
+    return conn
+
+def _ensure_schema(conn):
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute('CREATE TABLE IF NOT EXISTS detections (id INTEGER PRIMARY KEY AUTOINCREMENT, ts INTEGER, obj_type TEXT, distance REAL)')
 
 def initialize_db_pool():
     conn = _create_conn()
-    c = conn.cursor()
-    c.execute('CREATE TABLE IF NOT EXISTS detections (id INTEGER PRIMARY KEY AUTOINCREMENT, ts TEXT, obj_type TEXT, distance REAL)')
-    conn.commit()
+    _ensure_schema(conn)
     conn.close()
-    for _ in range(DB_POOL_MAX):
-        try:
-            DB_POOL.put_nowait(_create_conn())
-        except:
-            break
+    with read_db() as conn:
+        _seed_counters(conn.cur)
 
-def get_db_conn(timeout=0.01):
+@contextmanager
+def read_db():
+    conn = getattr(_read_local, "conn", None)
+    if conn is None:
+        conn = _read_local.conn = _create_conn(read_only=True)
     try:
-        conn = DB_POOL.get(timeout=timeout)
-    except Empty:
-        conn = _create_conn()
-    return conn
+        yield conn
+    except sqlite3.Error:
+        # don't hand a possibly broken connection to this thread's next request
+        conn.close()
+        _read_local.conn = None
+        raise
 
-def release_db_conn(conn):
-    try:
-        DB_POOL.put_nowait(conn)
-    except:
-        try:
-            conn.close()
-        except:
-            pass
+def _seed_counters(c):
+    global _total_detections, _last_detection_id
+    c.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM detections")
+    total, last_id = c.fetchone()
+    c.execute("SELECT id, ts, obj_type, distance FROM detections ORDER BY id DESC LIMIT ?", (HISTORY_LIMIT,))
+    rows = c.fetchall()
+    with _counters_lock:
+        _total_detections = total
+        _last_detection_id = last_id
+        _recent_detections.clear()
+        _recent_detections.extend(rows)
 
-@lru_cache(maxsize=32)
-def get_cached_total_detections():
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM detections")
-    total = c.fetchone()[0]
-    release_db_conn(conn)
-    return total
+_EPOCH = datetime(1970, 1, 1)
+
+def ts_to_iso(ts):
+    # ts is stored as integer ns since the epoch (UTC); rows written before that
+    # hold ISO text, and an old TEXT-typed column stores the integer as text
+    if isinstance(ts, str):
+        if not ts.isdigit():
+            return ts
+        ts = int(ts)
+    return (_EPOCH + timedelta(microseconds=ts // 1000)).isoformat()
+
+@lru_cache(maxsize=1024)
+def _secure_filename(filename):
+    return secure_filename(filename)
+
+def _save_upload(f, path):
+    with open(path, "wb", buffering=UPLOAD_CHUNK) as dst:
+        shutil.copyfileobj(f.stream, dst, UPLOAD_CHUNK)
+
+def get_total_detections():
+    return _total_detections
+
+def get_recent_history():
+    with _counters_lock:
+        return list(_recent_detections)
 
 @lru_cache(maxsize=32)
-def get_cached_history(limit=50):
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute("SELECT ts, obj_type, distance FROM detections ORDER BY id DESC LIMIT ?", (limit,))
-    rows = c.fetchall()
-    release_db_conn(conn)
-    return tuple(rows)
+def get_cached_history_page(before_id, limit, version):
+    # keyset paging: "id" is the rowid, so this is a range scan on the table b-tree
+    with read_db() as conn:
+        conn.cur.execute(HISTORY_PAGE_SQL, (before_id, limit))
+        return tuple(conn.cur.fetchall())
 
-def invalidate_caches():
-    get_cached_total_detections.cache_clear()
-    get_cached_history.cache_clear()
+def get_history_page(before_id, limit=HISTORY_LIMIT):
+    # entries for older versions are never hit again and age out of the LRU
+    return get_cached_history_page(before_id, limit, _cache_version)
 
 def worker():
     while True:
@@ -90,37 +173,155 @@ def worker():
             print("[worker] Task error:", e)
         TASK_QUEUE.task_done()
 
+def _collect_batch(q, max_items, window):
+    batch = [q.get()]
+    deadline = time.monotonic() + window
+    while len(batch) < max_items:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(q.get(timeout=remaining))
+        except Empty:
+            break
+    return batch
+
+def _drain_batch(q, max_items, window):
+    # blocks for the first item only, then takes what is already queued: a lone
+    # item is handled at once and batches only form under load
+    batch = [q.get()]
+    deadline = time.monotonic() + window
+    while len(batch) < max_items and time.monotonic() < deadline:
+        try:
+            batch.append(q.get_nowait())
+        except Empty:
+            break
+    return batch
+
+def _publish_committed(rows, first_id):
+    global _total_detections, _last_detection_id, _cache_version
+    with _counters_lock:
+        _recent_detections.extendleft((i, *row) for i, row in enumerate(rows, first_id))
+        _total_detections += len(rows)
+        _last_detection_id = first_id + len(rows) - 1
+        _cache_version += 1
+
+def db_writer():
+    # SQLite serializes writers even in WAL mode, so all writes go through this
+    # thread's own connection; it does not depend on _startup() having run.
+    # Queue items are (rows, Future); each future gets the ids of its rows.
+    try:
+        conn = _create_conn()
+        _ensure_schema(conn)
+    except Exception as e:
+        # without a connection every job fails at once instead of leaving callers waiting
+        print("[db_writer] Startup error:", e)
+        while True:
+            _, done = DETECTION_QUEUE.get()
+            done.set_exception(e)
+            DETECTION_QUEUE.task_done()
+    c = conn.cur
+    while True:
+        jobs = _drain_batch(DETECTION_QUEUE, WRITER_BATCH_MAX, WRITER_BATCH_WINDOW)
+        rows = [row for job_rows, _ in jobs for row in job_rows]
+        try:
+            c.execute("BEGIN IMMEDIATE")
+            c.executemany(INSERT_DETECTIONS_SQL, rows)
+            # BEGIN IMMEDIATE holds the write lock, so AUTOINCREMENT handed out consecutive ids
+            c.execute("SELECT last_insert_rowid()")
+            first_id = c.fetchone()[0] - len(rows) + 1
+            c.execute("COMMIT")
+        except Exception as e:
+            # a bad batch is dropped, never the thread, and nothing of it is published
+            try:
+                if conn.in_transaction:
+                    c.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            print("[db_writer] Batch insert error:", e)
+            for _, done in jobs:
+                done.set_exception(e)
+        else:
+            _publish_committed(rows, first_id)
+            for job_rows, done in jobs:
+                done.set_result(range(first_id, first_id + len(job_rows)))
+                first_id += len(job_rows)
+        for _ in jobs:
+            DETECTION_QUEUE.task_done()
+
 for _ in range(BACKGROUND_WORKERS):
     t = Thread(target=worker, daemon=True)
     t.start()
 
+Thread(target=db_writer, daemon=True).start()
+
+def record_detections(detections):
+    # waits for db_writer() to commit the rows (batched with whatever other callers
+    # queued meanwhile); ids come from AUTOINCREMENT, so several processes can share
+    # the database. Raises if the insert failed or took over WRITER_RESULT_TIMEOUT.
+    ts = time.time_ns()
+    rows = [(ts, obj_type, distance) for obj_type, distance in detections]
+    if not rows:
+        return []
+    done = Future()
+    DETECTION_QUEUE.put((rows, done))
+    ids = done.result(timeout=WRITER_RESULT_TIMEOUT)
+    return [{"id": i, "ts": ts, "obj_type": r[1], "distance": r[2]} for i, r in zip(ids, rows)]
+
 def record_detection(obj_type, distance):
-    ts = datetime.utcnow().isoformat()
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute("INSERT INTO detections (ts, obj_type, distance) VALUES (?, ?, ?)", (ts, obj_type, distance))
-    conn.commit()
-    release_db_conn(conn)
-    invalidate_caches()
-    return {"ts": ts, "obj_type": obj_type, "distance": distance}
+    return record_detections(((obj_type, distance),))[0]
+
+def emit_worker():
+    while True:
+        batch = _collect_batch(EMIT_QUEUE, EMIT_BATCH_MAX, EMIT_BATCH_WINDOW)
+        items = [dict(det, ts=ts_to_iso(det["ts"])) for det in batch]
+        socketio.emit('detections_batch', {"count": len(items), "items": items})
+
+def queue_alert(det):
+    # alerts are best-effort: drop rather than block a request when clients lag
+    try:
+        EMIT_QUEUE.put_nowait(det)
+    except Full:
+        pass
 
 def simulate_detection_from_file(path):
-    h = sum(bytearray(path.encode('utf-8'))) % 100
+    h = zlib.crc32(path.encode('utf-8')) % 100
     obj = "pedestrian" if (h % 2 == 0) else "vehicle"
     distance = round(0.5 + (h / 100.0) * 5.0, 2)
     return {"obj_type": obj, "distance": distance}
 
 def process_video_async(path):
-    for i in range(4):
-        det = simulate_detection_from_file(path + str(i))
-        rec = record_detection(det["obj_type"], det["distance"])
-        if settings["alerts_enabled"] and rec["distance"] <= settings["threshold"]:
-            socketio.emit('detection', rec)
-        time.sleep(2)
+    # the whole clip is one batch: one counter update, one insert transaction
+    # and, through emit_worker(), one websocket event
+    sims = [simulate_detection_from_file(path + str(i)) for i in range(VIDEO_SIM_DETECTIONS)]
+    recs = record_detections([(d["obj_type"], d["distance"]) for d in sims])
+    if settings["alerts_enabled"]:
+        threshold = settings["threshold"]
+        for rec in recs:
+            if rec["distance"] <= threshold:
+                queue_alert(rec)
+
+def ojson(payload):
+    if orjson is None:
+        return jsonify(payload)
+    return app.response_class(orjson.dumps(payload), mimetype="application/json")
+
+def conditional_ojson(etag, build_payload):
+    # build_payload only runs when the client's copy is stale
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = ojson(build_payload())
+    response.set_etag(etag, weak=True)
+    return response
 
 @app.after_request
 def add_cache_headers(response):
-    response.headers["Cache-Control"] = "public, max-age=604800"
+    if request.endpoint == "static":
+        response.headers["Cache-Control"] = "public, max-age=604800, immutable"
+    else:
+        # dynamic data: clients must revalidate (ETag) before reusing a response
+        response.headers["Cache-Control"] = "no-cache"
     return response
 
 @app.route('/')
@@ -129,13 +330,21 @@ def index():
 
 @app.route('/stats')
 def stats():
-    total = get_cached_total_detections()
-    return jsonify({"total_detections": total, "threshold": settings["threshold"], "alerts_enabled": settings["alerts_enabled"]})
+    total = get_total_detections()
+    threshold, alerts_enabled = settings["threshold"], settings["alerts_enabled"]
+    etag = f"stats-{total}-{threshold}-{int(alerts_enabled)}"
+    return conditional_ojson(etag, lambda: {"total_detections": total, "threshold": threshold, "alerts_enabled": alerts_enabled})
 
 @app.route('/history')
 def history():
-    rows = get_cached_history(50)
-    return jsonify([{"ts": r[0], "obj_type": r[1], "distance": r[2]} for r in rows])
+    before_id = request.args.get("before_id", type=int)
+    if before_id is None:
+        etag = f"history-{_last_detection_id}"
+        load_rows = get_recent_history
+    else:
+        etag = f"history-{before_id}-{_cache_version}"
+        load_rows = lambda: get_history_page(before_id)
+    return conditional_ojson(etag, lambda: [{"id": r[0], "ts": ts_to_iso(r[1]), "obj_type": r[2], "distance": r[3]} for r in load_rows()])
 
 @app.route('/set_threshold', methods=["POST"])
 def set_threshold():
@@ -165,23 +374,23 @@ def upload_photo():
     f = request.files.get("file")
     if not f:
         return "No file", 400
-    filename = secure_filename(f.filename)
+    filename = _secure_filename(f.filename)
     path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    f.save(path)
+    _save_upload(f, path)
     simulated = simulate_detection_from_file(path)
     det = record_detection(simulated["obj_type"], simulated["distance"])
     if settings["alerts_enabled"] and det["distance"] <= settings["threshold"]:
-        socketio.emit('detection', det)
-    return jsonify({"ok": True, "detection": det})
+        queue_alert(det)
+    return jsonify({"ok": True, "detection": dict(det, ts=ts_to_iso(det["ts"]))})
 
 @app.route('/upload_video_feed', methods=["POST"])
 def upload_video_feed():
     f = request.files.get("file")
     if not f:
         return "No file", 400
-    filename = secure_filename(f.filename)
+    filename = _secure_filename(f.filename)
     path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    f.save(path)
+    _save_upload(f, path)
     TASK_QUEUE.put((process_video_async, (path,)))
     return jsonify({"ok": True, "message": "Video uploaded. Processing started."})
 
@@ -191,7 +400,16 @@ def handle_connect():
 
 def _startup():
     initialize_db_pool()
+    socketio.start_background_task(emit_worker)
+
+# at import rather than under __main__, so WSGI servers (gunicorn) get the same setup
+_startup()
 
+# Production entry point, run from this directory (importing the module runs _startup()):
+#   gunicorn -w 1 --threads 100 app1:app
+# More worker processes (-w N) need sticky sessions for Socket.IO and
+# SOCKETIO_MESSAGE_QUEUE; see the note on the in-memory counters above.
+# `python app1.py` is the development server only.
 if __name__ == '__main__':
-    _startup()
-    socketio.run(app, host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    # Werkzeug refuses to start without a TTY (nohup, systemd, docker) unless allowed
+    socketio.run(app, host="0.0.0.0", port=5000, debug=True, allow_unsafe_werkzeug=True)
\ No newline at end of file
@@ -0,0 +1,192 @@
+"""
+_kernels.py
+Numba-compiled inner loops shared by the distance methods.
+numba is optional: check NUMBA_AVAILABLE and fall back to the NumPy code paths when it is False.
+Kernels are compiled (or loaded from numba's on-disk cache) by warmup() at import,
+so the first frame of a pipeline does not stall on JIT compilation.
+
+Usage:
+    from distance_methods._kernels import NUMBA_AVAILABLE, bbox_disparity_stat, bbox_stereo_depths
+    from distance_methods._kernels import bbox_finite_gather
+    from distance_methods._kernels import pinhole_batch_c  # C-ABI entry point, None without numba
+"""
+
+import numpy as np
+
+try:
+    from numba import get_num_threads, njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def get_num_threads():
+        return 1
+
+    def njit(*args, **kwargs):
+        # no-op stand-in so the kernels below still define; callers must not use them
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+
+@njit(cache=True)
+def select_kth(a, n, k):
+    """
+    Reorder a[:n] in place (Hoare partition quickselect) so that a[k] is its k-th smallest
+    value and a[:k] holds the k values below it. Returns a[k]. O(n) on average.
+    """
+    lo, hi = 0, n - 1
+    while lo < hi:
+        pivot = a[(lo + hi) // 2]
+        i, j = lo, hi
+        while i <= j:
+            while a[i] < pivot:
+                i += 1
+            while a[j] > pivot:
+                j -= 1
+            if i <= j:
+                a[i], a[j] = a[j], a[i]
+                i += 1
+                j -= 1
+        if k <= j:
+            hi = j
+        elif k >= i:
+            lo = i
+        else:
+            break
+    return a[k]
+
+
+@njit(cache=True)
+def median_inplace(a, n):
+    """Median of a[:n] (mean of the two middle values for even n). Reorders a[:n]."""
+    k = n // 2
+    upper = select_kth(a, n, k)
+    if n % 2:
+        return upper
+    lower = a[0]
+    for i in range(1, k):
+        if a[i] > lower:
+            lower = a[i]
+    return 0.5 * (lower + upper)
+
+
+@njit(cache=True)
+def bbox_disparity_stat(disp, x1, y1, x2, y2, use_median, scratch):
+    """
+    Median (or mean) of the positive disparities in disp[y1:y2+1, x1:x2+1], in one pass.
+    scratch: 1-D buffer of at least the box area, reused for the median selection.
+    Returns 0.0 when the box holds no valid disparity.
+    """
+    m = 0
+    total = 0.0
+    for i in range(y1, y2 + 1):
+        for j in range(x1, x2 + 1):
+            v = disp[i, j]
+            if v > 0:
+                if use_median:
+                    scratch[m] = v
+                total += v
+                m += 1
+    if m == 0:
+        return 0.0
+    if use_median:
+        return median_inplace(scratch, m)
+    return total / m
+
+
+@njit(parallel=True, cache=True)
+def bbox_stereo_depths(disp, bboxes, focal_baseline, scratch, out):
+    """
+    Depth (meters) = focal_baseline / median positive disparity inside each bbox, boxes in parallel.
+    focal_baseline being focal_length_px * baseline_m (already scaled for fixed-point maps).
+    disp: read-only 2-D float32, float64 or uint16 map; each dtype compiles its own specialization.
+    bboxes: (N, 4) int64 array of clipped (x1, y1, x2, y2), inclusive
+    scratch: (lanes, largest box area) buffer for the median selection; lane r reduces boxes
+    r, r + lanes, ... in its own row and lanes run in parallel, so the loop never allocates.
+    out: (N,) float64, filled with the depths, inf for empty boxes or boxes without valid disparity.
+    """
+    lanes = scratch.shape[0]
+    n = bboxes.shape[0]
+    for r in prange(lanes):
+        for k in range(r, n, lanes):
+            x1, y1, x2, y2 = bboxes[k, 0], bboxes[k, 1], bboxes[k, 2], bboxes[k, 3]
+            if x2 <= x1 or y2 <= y1:
+                out[k] = np.inf
+                continue
+            med = bbox_disparity_stat(disp, x1, y1, x2, y2, True, scratch[r])
+            out[k] = np.inf if med <= 0 else focal_baseline / med
+
+
+@njit(parallel=True, cache=True)
+def bbox_finite_gather(values, bboxes, strides, offsets, buf, counts):
+    """
+    Copy the finite values inside each bbox of a 2-D map into buf[offsets[k]:], boxes in parallel.
+    Box k is read with step strides[k] on both axes; counts[k] receives how many values were kept.
+    bboxes: (N, 4) int64 array of clipped (x1, y1, x2, y2), inclusive; empty boxes get count 0.
+    buf must hold each strided box at its offset, so the loop itself never allocates.
+    """
+    for k in prange(bboxes.shape[0]):
+        x1, y1, x2, y2 = bboxes[k, 0], bboxes[k, 1], bboxes[k, 2], bboxes[k, 3]
+        m = offsets[k]
+        if x2 > x1 and y2 > y1:
+            s = strides[k]
+            for i in range(y1, y2 + 1, s):
+                for j in range(x1, x2 + 1, s):
+                    v = values[i, j]
+                    if np.isfinite(v):
+                        buf[m] = v
+                        m += 1
+        counts[k] = m - offsets[k]
+
+
+if NUMBA_AVAILABLE:
+    from numba import carray, cfunc, types
+    from distance_methods.pinhole_method import KNOWN_HEIGHTS_ARR, OBJECT_CLASS_IDS
+
+    # frozen into the compiled code as constants
+    _PINHOLE_HEIGHTS = KNOWN_HEIGHTS_ARR.copy()
+    _PINHOLE_DEFAULT_ID = OBJECT_CLASS_IDS["person"]
+
+    @cfunc(types.void(types.CPointer(types.float64), types.CPointer(types.int32), types.intp,
+                      types.float64, types.CPointer(types.float64)), cache=True)
+    def pinhole_batch_c(heights_ptr, class_ids_ptr, n, focal_length_px, out_ptr):
+        """
+        C signature: void (const double *heights_px, const int32_t *class_ids, intptr_t n,
+                           double focal_length_px, double *out)
+        Pinhole estimate_distance_batch for callers outside the interpreter; take the function
+        pointer from pinhole_batch_c.address, or call pinhole_batch_c.ctypes from Python.
+        Unknown class ids count as 'person'; heights <= 0 give inf.
+        """
+        heights = carray(heights_ptr, n)
+        class_ids = carray(class_ids_ptr, n)
+        out = carray(out_ptr, n)
+        for i in range(n):
+            h = heights[i]
+            c = class_ids[i]
+            if c < 0 or c >= _PINHOLE_HEIGHTS.size:
+                c = _PINHOLE_DEFAULT_ID
+            out[i] = _PINHOLE_HEIGHTS[c] * focal_length_px / h if h > 0 else np.inf
+else:
+    pinhole_batch_c = None
+
+
+def warmup():
+    """Compile each kernel for the map dtypes the distance methods pass in (float32, float64, uint16)."""
+    boxes = np.array([[0, 0, 1, 1]], dtype=np.int64)
+    ones = np.ones(1, dtype=np.int64)
+    offsets = np.array([0, 4], dtype=np.int64)
+    for dtype in (np.float32, np.float64, np.uint16):
+        disp = np.ones((2, 2), dtype=dtype)
+        # median scratch is float64 for float64 maps and float32 otherwise, as in stereo_depth
+        scratch = np.empty((1, 4), dtype=np.float64 if dtype == np.float64 else np.float32)
+        bbox_disparity_stat(disp, 0, 0, 1, 1, True, scratch[0])
+        bbox_disparity_stat(disp, 0, 0, 1, 1, False, scratch[0])
+        bbox_stereo_depths(disp, boxes, 1.0, scratch, np.empty(1))
+        if dtype != np.uint16:
+            bbox_finite_gather(disp, boxes, ones, offsets, np.empty(4, dtype=dtype), np.empty(1, dtype=np.int64))
+
+
+if NUMBA_AVAILABLE:
+    warmup()
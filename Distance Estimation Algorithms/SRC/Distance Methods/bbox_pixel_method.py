@@ -4,7 +4,7 @@ Fit a simple inverse model: distance ~= a / bbox_height_px + b
 Use calibrations to compute a and b or set defaults.
 
 Usage:
-    from distance_methods.bbox_pixel_method import estimate_distance, fit_model
+    from distance_methods.bbox_pixel_method import estimate_distance, estimate_distance_batch, fit_model
 """
 
 from typing import Tuple
@@ -17,18 +17,42 @@ def estimate_distance(bbox_height_px: float, coeffs: Tuple[float,float] = DEFAUL
     a, b = coeffs
     if bbox_height_px <= 0:
         return float("inf")
-    return float(a / float(bbox_height_px) + b)
+    return float(a / bbox_height_px + b)
+
+def estimate_distance_batch(bbox_heights_px: np.ndarray, coeffs: Tuple[float,float] = DEFAULT_COEFFS) -> np.ndarray:
+    """
+    Vectorized estimate_distance for an array of bbox heights (px).
+    Returns an array of distances in meters, inf where the height is <= 0.
+    """
+    a, b = coeffs
+    h = np.asarray(bbox_heights_px, dtype=float)
+    out = np.full(h.shape, np.inf)
+    np.divide(a, h, out=out, where=h > 0)
+    out += b  # inf + b stays inf, so no second mask is needed
+    return out
 
 def fit_model(pixel_heights: np.ndarray, true_distances: np.ndarray) -> Tuple[float,float]:
     """
     Fit a simple inverse linear model distance = a / h + b using least squares.
+    Samples with a non-positive or non-finite height, or a non-finite distance, are ignored.
     pixel_heights: array of bbox heights in px
     true_distances: corresponding true distances in meters
     Returns coefficients (a, b)
     """
-    # transform: y = a * (1/h) + b  --> linear regression on x = (1/h)
-    X = np.vstack([1.0 / pixel_heights, np.ones_like(pixel_heights)]).T
-    y = true_distances
-    params, *_ = np.linalg.lstsq(X, y, rcond=None)
-    a, b = params[0], params[1]
+    # transform: y = a * (1/h) + b  --> closed-form simple linear regression on x = (1/h)
+    h = np.asarray(pixel_heights, dtype=float)
+    y = np.asarray(true_distances, dtype=float)
+    valid = (h > 0) & np.isfinite(h) & np.isfinite(y)
+    if not valid.all():
+        h, y = h[valid], y[valid]
+    if h.size < 2:
+        raise ValueError("fit_model needs at least two valid (height, distance) samples.")
+    x = 1.0 / h
+    x_mean = x.mean()
+    x -= x_mean
+    sxx = np.dot(x, x)
+    if sxx == 0:
+        raise ValueError("fit_model needs at least two distinct pixel heights.")
+    a = np.dot(x, y) / sxx  # x is centered, so y needs no centering
+    b = y.mean() - a * x_mean
     return float(a), float(b)
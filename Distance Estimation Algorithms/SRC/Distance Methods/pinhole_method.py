@@ -4,11 +4,16 @@ Estimate distance using Pinhole Camera Model:
     distance = (object_real_height_m * focal_length_px) / bbox_height_px
 
 Usage:
-    from distance_methods.pinhole_method import estimate_distance
+    from distance_methods.pinhole_method import estimate_distance, estimate_distance_batch, estimate_distance_id, OBJECT_CLASS_IDS
     d = estimate_distance(bbox_height_px, object_class='person', camera_params=camera_params)
+    d = estimate_distance_id(bbox_height_px, OBJECT_CLASS_IDS['person'], focal_length_px)
+    ds = estimate_distance_batch(bbox_heights_px, object_classes, camera_params=camera_params)
 """
 
-from typing import Dict
+import math
+from functools import lru_cache
+from typing import Dict, Sequence, Union
+import numpy as np
 
 # default average heights (meters) per class
 DEFAULT_OBJECT_HEIGHTS = {
@@ -18,6 +23,21 @@ DEFAULT_OBJECT_HEIGHTS = {
     "motorbike": 1.1,
 }
 
+# integer class ids, indexing KNOWN_HEIGHTS_ARR (meters) in the same order
+OBJECT_CLASS_IDS = {name: i for i, name in enumerate(DEFAULT_OBJECT_HEIGHTS)}
+KNOWN_HEIGHTS_ARR = np.array(list(DEFAULT_OBJECT_HEIGHTS.values()))
+# tuple copy for scalar lookups, indexing a tuple is much cheaper than an ndarray
+_KNOWN_HEIGHTS = tuple(DEFAULT_OBJECT_HEIGHTS.values())
+_DEFAULT_CLASS_ID = OBJECT_CLASS_IDS["person"]
+
+def _focal_length_px(camera_params: Dict[str, float]) -> float:
+    if camera_params is None:
+        raise ValueError("camera_params must include 'focal_length_px' (pixels).")
+    f = camera_params.get("focal_length_px")
+    if f is None:
+        raise ValueError("camera_params must contain 'focal_length_px' (in pixels).")
+    return f
+
 def estimate_distance(bbox_height_px: float,
                       object_class: str = "person",
                       camera_params: Dict[str, float] = None) -> float:
@@ -35,25 +55,68 @@ def estimate_distance(bbox_height_px: float,
     if bbox_height_px <= 0:
         return float("inf")
 
-    if camera_params is None:
-        raise ValueError("camera_params must include 'focal_length_px' (pixels).")
+    f = _focal_length_px(camera_params)
+    # a dict lookup beats indexing KNOWN_HEIGHTS_ARR for a single Python scalar
+    H = DEFAULT_OBJECT_HEIGHTS.get(object_class, DEFAULT_OBJECT_HEIGHTS["person"])
+    return float(H * f / bbox_height_px)
 
-    f = camera_params.get("focal_length_px")
-    if f is None:
-        raise ValueError("camera_params must contain 'focal_length_px' (in pixels).")
 
-    H = DEFAULT_OBJECT_HEIGHTS.get(object_class, DEFAULT_OBJECT_HEIGHTS["person"])
+def estimate_distance_id(bbox_height_px: float, class_id: int, focal_length_px: float) -> float:
+    """
+    estimate_distance for a detector's integer class id (see OBJECT_CLASS_IDS)
+    and an already validated focal length, skipping the name and dict lookups.
+    Ids outside the table count as 'person', as in estimate_distance_batch.
+    """
+    if bbox_height_px <= 0:
+        return float("inf")
+    if not 0 <= class_id < len(_KNOWN_HEIGHTS):
+        class_id = _DEFAULT_CLASS_ID
+    return _KNOWN_HEIGHTS[class_id] * focal_length_px / bbox_height_px
+
 
-    distance_m = (H * f) / float(bbox_height_px)
-    return float(distance_m)
+def estimate_distance_batch(bbox_heights_px: np.ndarray,
+                            object_classes: Union[Sequence[str], Sequence[int], np.ndarray],
+                            camera_params: Dict[str, float] = None) -> np.ndarray:
+    """
+    Vectorized estimate_distance for N boxes.
+
+    Args:
+        bbox_heights_px: array of N bounding box heights in pixels
+        object_classes: N class names, or N OBJECT_CLASS_IDS ids (array or list, integer
+                        or integral float); unknown names and out-of-range ids count as 'person'
+        camera_params: same as estimate_distance
+
+    Returns:
+        array of N distances in meters, inf where the height is <= 0
+    """
+    f = _focal_length_px(camera_params)
+    h = np.asarray(bbox_heights_px, dtype=float)
+    classes = np.asarray(object_classes)
+    kind = classes.dtype.kind
+    if kind in "iuf":
+        # float ids come straight from detectors (e.g. ultralytics boxes.cls); range-check before the cast
+        if kind == "f" and not np.array_equal(classes, np.trunc(classes)):
+            raise TypeError("float class ids must be integral, got %r" % (object_classes,))
+        in_range = (classes >= 0) & (classes < KNOWN_HEIGHTS_ARR.size)
+        idx = np.where(in_range, classes, _DEFAULT_CLASS_ID).astype(np.intp, copy=False)
+    elif kind in "bc":
+        raise TypeError("object_classes must be class names or integer ids, got dtype %s" % classes.dtype)
+    else:
+        idx = np.fromiter((OBJECT_CLASS_IDS.get(c, _DEFAULT_CLASS_ID) for c in object_classes),
+                          dtype=np.intp, count=len(object_classes))
+    H = np.take(KNOWN_HEIGHTS_ARR, idx)
+    valid = h > 0
+    out = np.full(h.shape, np.inf)
+    np.divide(H * f, h, out=out, where=valid)
+    return out
 
 
 # Example helper: compute focal length px from calibration data
+@lru_cache(maxsize=32)
 def focal_length_px_from_fov(image_height_px: int, vertical_fov_deg: float) -> float:
     """
     Approximate focal length in pixels from vertical field-of-view:
     f = (image_height_px / 2) / tan(vfov/2)
+    Cached per (image_height_px, vertical_fov_deg), so re-deriving it per frame is a lookup.
     """
-    import math
-    vfov_rad = math.radians(vertical_fov_deg)
-    return (image_height_px / 2.0) / math.tan(vfov_rad / 2.0)
+    return 0.5 * image_height_px / math.tan(math.radians(vertical_fov_deg) * 0.5)
@@ -6,27 +6,88 @@ Requires:
   - camera baseline (meters) and focal length (pixels)
 
 Usage:
-  from distance_methods.stereo_depth import disparity_to_depth, estimate_bbox_depth
+  from distance_methods.stereo_depth import disparity_to_depth, estimate_bbox_depth, estimate_bboxes_depth
+  The *_fb variants take focal_baseline = focal_length_px * baseline_m, computed once per camera.
+
+Disparity maps are best kept as C-contiguous float32 (see prepare_disparity_map).
+Fixed-point maps (e.g. KITTI uint16, disparity * 256) are read without a float copy by
+passing disparity_scale=KITTI_DISPARITY_SCALE; by default values are plain pixels.
 """
 
+import threading
 import numpy as np
+from distance_methods._kernels import NUMBA_AVAILABLE, bbox_disparity_stat, bbox_stereo_depths, get_num_threads
+
+# raw / disparity_px for KITTI-style uint16 disparity maps
+KITTI_DISPARITY_SCALE = 256.0
+
+# per-thread median scratch for estimate_bbox_depth, one per dtype; buffers above
+# SCRATCH_KEEP_MAX elements are allocated per call so no thread pins a frame-sized buffer
+SCRATCH_KEEP_MAX = 1 << 18
+_TLS = threading.local()
+
+def _scratch_dtype(disparity_map: np.ndarray):
+    # float32 holds every float32 and uint16 disparity exactly
+    return np.float64 if disparity_map.dtype == np.float64 else np.float32
+
+def _get_scratch(n: int, dtype) -> np.ndarray:
+    if n > SCRATCH_KEEP_MAX:
+        return np.empty(n, dtype=dtype)
+    name = np.dtype(dtype).name
+    buf = getattr(_TLS, name, None)
+    if buf is None or buf.size < n:
+        buf = np.empty(max(n, 1024), dtype=dtype)
+        setattr(_TLS, name, buf)
+    return buf
 
-def disparity_to_depth(disparity_px: float, focal_length_px: float, baseline_m: float) -> float:
+def prepare_disparity_map(disparity_map: np.ndarray) -> np.ndarray:
+    """
+    Coerce a disparity map once at ingest: uint16 maps are kept as is (pass their
+    disparity_scale to the depth functions), anything else becomes C-contiguous
+    float32 (half the bytes of float64).
+    """
+    if disparity_map.dtype == np.uint16:
+        return np.ascontiguousarray(disparity_map)
+    return np.ascontiguousarray(disparity_map, dtype=np.float32)
+
+def disparity_to_depth(disparity_px, focal_length_px: float, baseline_m: float, disparity_scale: float = 1.0):
     """
     Convert disparity (pixels) to depth (meters):
         depth = (focal_length_px * baseline_m) / disparity_px
+    disparity_px may be a scalar (returns float) or an array such as a whole
+    disparity map (returns an array of the same shape, inf where disparity <= 0).
+    disparity_scale: raw values per pixel of disparity (KITTI_DISPARITY_SCALE for KITTI maps)
     """
-    if disparity_px <= 0:
-        return float("inf")
-    return (focal_length_px * baseline_m) / float(disparity_px)
+    return disparity_to_depth_fb(disparity_px, focal_length_px * baseline_m, disparity_scale)
 
-def estimate_bbox_depth(disparity_map: np.ndarray, bbox: tuple, focal_length_px: float, baseline_m: float, method: str = "median"):
+def disparity_to_depth_fb(disparity_px, focal_baseline: float, disparity_scale: float = 1.0):
+    """disparity_to_depth with focal_length_px * baseline_m precomputed."""
+    # depth = fb / (raw / scale) = (fb * scale) / raw, so raw maps are never scaled per pixel
+    focal_baseline = focal_baseline * disparity_scale
+    if np.isscalar(disparity_px):
+        if disparity_px <= 0:
+            return float("inf")
+        return focal_baseline / float(disparity_px)
+    disp = np.asarray(disparity_px)
+    out = np.full(disp.shape, np.inf, dtype=np.result_type(disp.dtype, np.float32))
+    np.divide(focal_baseline, disp, out=out, where=disp > 0)
+    return out
+
+def estimate_bbox_depth(disparity_map: np.ndarray, bbox: tuple, focal_length_px: float, baseline_m: float, method: str = "median",
+                        disparity_scale: float = 1.0):
     """
     Estimate object depth from disparity map inside bbox.
     bbox = (x1,y1,x2,y2)
     method = 'median' or 'mean'
+    disparity_scale: as in disparity_to_depth
     Returns meters
     """
+    return estimate_bbox_depth_fb(disparity_map, bbox, focal_length_px * baseline_m, method=method,
+                                  disparity_scale=disparity_scale)
+
+def estimate_bbox_depth_fb(disparity_map: np.ndarray, bbox: tuple, focal_baseline: float, method: str = "median",
+                           disparity_scale: float = 1.0):
+    """estimate_bbox_depth with focal_length_px * baseline_m precomputed."""
     x1,y1,x2,y2 = bbox
     # ensure integers & bounds
     h, w = disparity_map.shape[:2]
@@ -36,12 +97,51 @@ def estimate_bbox_depth(disparity_map: np.ndarray, bbox: tuple, focal_length_px:
     y2 = min(h-1, int(round(y2)))
     if x2 <= x1 or y2 <= y1:
         return float("inf")
+    focal_baseline = focal_baseline * disparity_scale
 
-    crop = disparity_map[y1:y2+1, x1:x2+1].astype(float)
+    if NUMBA_AVAILABLE:
+        use_median = method == "median"
+        scratch = _get_scratch((y2 - y1 + 1) * (x2 - x1 + 1) if use_median else 0, _scratch_dtype(disparity_map))
+        disp = bbox_disparity_stat(disparity_map, x1, y1, x2, y2, use_median, scratch)
+        return disparity_to_depth_fb(disp, focal_baseline)
+
+    crop = disparity_map[y1:y2+1, x1:x2+1].astype(np.float32)
     # mask invalid disparities (<=0)
     crop = crop[crop > 0]
     if crop.size == 0:
         return float("inf")
 
-    disp = np.median(crop) if method == "median" else np.mean(crop)
-    return disparity_to_depth(disp, focal_length_px, baseline_m)
+    disp = np.median(crop) if method == "median" else np.mean(crop, dtype=np.float64)
+    return disparity_to_depth_fb(float(disp), focal_baseline)
+
+def estimate_bboxes_depth(disparity_map: np.ndarray, bboxes: np.ndarray, focal_length_px: float, baseline_m: float,
+                          disparity_scale: float = 1.0) -> np.ndarray:
+    """
+    Median-disparity depth for N boxes of the same frame in one call.
+    bboxes = (N, 4) array of (x1,y1,x2,y2)
+    disparity_scale: as in disparity_to_depth
+    Returns (N,) array of meters, inf where estimate_bbox_depth would return inf.
+    """
+    return estimate_bboxes_depth_fb(disparity_map, bboxes, focal_length_px * baseline_m, disparity_scale)
+
+def estimate_bboxes_depth_fb(disparity_map: np.ndarray, bboxes: np.ndarray, focal_baseline: float,
+                             disparity_scale: float = 1.0) -> np.ndarray:
+    """estimate_bboxes_depth with focal_length_px * baseline_m precomputed."""
+    # layout only: dtype coercion belongs at ingest (prepare_disparity_map), not per frame
+    disparity_map = np.ascontiguousarray(disparity_map)
+    boxes = np.rint(np.asarray(bboxes, dtype=float).reshape(-1, 4)).astype(np.int64)
+    if not NUMBA_AVAILABLE:
+        return np.array([estimate_bbox_depth_fb(disparity_map, tuple(b), focal_baseline, disparity_scale=disparity_scale)
+                         for b in boxes])
+    h, w = disparity_map.shape[:2]
+    np.maximum(boxes[:, :2], 0, out=boxes[:, :2])
+    np.minimum(boxes[:, 2], w - 1, out=boxes[:, 2])
+    np.minimum(boxes[:, 3], h - 1, out=boxes[:, 3])
+    areas = (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1)
+    max_area = max(int(areas.max(initial=0)), 0)
+    # one scratch row per parallel lane, never more lanes than boxes; freed after the call
+    lanes = max(min(get_num_threads(), boxes.shape[0]), 1)
+    scratch = np.empty((lanes, max_area), dtype=_scratch_dtype(disparity_map))
+    out = np.empty(boxes.shape[0])
+    bbox_stereo_depths(disparity_map, boxes, float(focal_baseline * disparity_scale), scratch, out)
+    return out
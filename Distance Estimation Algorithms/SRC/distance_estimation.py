@@ -2,67 +2,285 @@
 distance_estimation.py
 
 Provides unified API to estimate distance for a bounding box using selected method.
+estimate_distance_for_bboxes does the same for all N boxes of a frame in one call.
 """
 
-from typing import Tuple, Dict
+import functools
+import logging
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Callable, Tuple, Dict, Optional, Union
+import numpy as np
 
 # Import methods
 from distance_methods.pinhole_method import estimate_distance as pinhole_estimate
-from distance_methods.bbox_pixel_method import estimate_distance as bbox_estimate
-from distance_methods.stereo_depth import estimate_bbox_depth as stereo_estimate
-# MiDaS optional import is lazy
-# from distance_methods.midas_depth import MiDaSDepth
+from distance_methods.pinhole_method import estimate_distance_batch as pinhole_estimate_batch
+from distance_methods.pinhole_method import estimate_distance_id as pinhole_estimate_id
+from distance_methods.bbox_pixel_method import DEFAULT_COEFFS, estimate_distance as bbox_estimate
+from distance_methods.bbox_pixel_method import estimate_distance_batch as bbox_estimate_batch
+from distance_methods.stereo_depth import estimate_bbox_depth_fb as stereo_estimate
+from distance_methods.stereo_depth import estimate_bboxes_depth_fb as stereo_estimate_batch
+# cheap to import; the MiDaS model itself (torch) is only loaded by _get_midas
+from distance_methods.midas_depth import MIDAS_AVAILABLE, MiDaSDepth
+
+logger = logging.getLogger(__name__)
+
+# boxes shorter than this are too far for a usable disparity; stereo falls back to pinhole
+MIN_STEREO_HEIGHT_PX = 12
+
+class Method(str, Enum):
+    """Distance estimation methods; members compare and hash equal to their plain strings."""
+    PINHOLE = "pinhole"
+    BBOX = "bbox"
+    STEREO = "stereo"
+    MIDAS = "midas"
+
+@dataclass(frozen=True, slots=True)
+class CameraContext:
+    """
+    Camera parameters bound once, so hot loops read attributes instead of dict keys.
+    Can be passed as camera_params and/or stereo_params to both dispatchers;
+    plain dicts are still accepted and read directly, only for the keys a method needs.
+    """
+    focal_length_px: Optional[float] = None
+    baseline_m: Optional[float] = None
+    bbox_coeffs: Tuple[float, float] = DEFAULT_COEFFS
+    device: str = "cpu"
+    min_height_px: float = MIN_STEREO_HEIGHT_PX
+    # raw disparity-map values per pixel, e.g. KITTI_DISPARITY_SCALE for KITTI uint16 maps
+    disparity_scale: float = 1.0
+    # focal_length_px * baseline_m, the stereo numerator, computed once here
+    focal_baseline: Optional[float] = field(init=False, default=None)
+
+    def __post_init__(self):
+        if self.focal_length_px is not None and self.baseline_m is not None:
+            object.__setattr__(self, "focal_baseline", self.focal_length_px * self.baseline_m)
+
+    @classmethod
+    def from_dict(cls, params: Optional[Dict]) -> "CameraContext":
+        if not params:
+            return cls()
+        coeffs = params.get("bbox_coeffs")
+        return cls(focal_length_px=params.get("focal_length_px"),
+                   baseline_m=params.get("baseline_m"),
+                   bbox_coeffs=DEFAULT_COEFFS if coeffs is None else tuple(coeffs),
+                   device=params.get("device", "cpu"),
+                   min_height_px=params.get("min_height_px", MIN_STEREO_HEIGHT_PX),
+                   disparity_scale=params.get("disparity_scale", 1.0))
+
+    def get(self, key: str, default=None):
+        """dict-style read, so a context can be handed to the method modules as camera_params."""
+        return getattr(self, key, default)
+
+CameraParams = Union[Dict, CameraContext, None]
+
+# readers for the parameters each method needs, from a dict, a CameraContext or None;
+# dicts are never converted, so callers that don't bind a context pay nothing extra
+
+def _bbox_coeffs(camera_params: CameraParams) -> Tuple[float, float]:
+    if camera_params is None:
+        return DEFAULT_COEFFS
+    if type(camera_params) is CameraContext:
+        return camera_params.bbox_coeffs
+    coeffs = camera_params.get("bbox_coeffs")
+    return DEFAULT_COEFFS if coeffs is None else coeffs
+
+def _stereo_focal_baseline(stereo_params: CameraParams) -> Tuple[float, float]:
+    """(focal_length_px * baseline_m * disparity_scale, min_height_px): the numerator for raw map values"""
+    if type(stereo_params) is CameraContext:
+        return stereo_params.focal_baseline * stereo_params.disparity_scale, stereo_params.min_height_px
+    return (stereo_params.get("focal_length_px") * stereo_params.get("baseline_m") * stereo_params.get("disparity_scale", 1.0),
+            stereo_params.get("min_height_px", MIN_STEREO_HEIGHT_PX))
+
+def _device(camera_params: CameraParams) -> str:
+    return camera_params.get("device", "cpu") if camera_params is not None else "cpu"
+
+@functools.lru_cache(maxsize=4)
+def _get_midas(device: str):
+    """One MiDaSDepth per device; loading the weights is the expensive part."""
+    return MiDaSDepth(device=device)
+
+def _midas_depth_map(image, depth_map, camera_params: CameraParams):
+    """
+    The caller's depth map if given, else one MiDaS inference on image.
+    Returns None when MiDaS is unavailable or not implemented.
+    There is deliberately no cache keyed on the image: capture loops reuse one frame buffer.
+    """
+    if depth_map is not None:
+        return depth_map
+    if not MIDAS_AVAILABLE:
+        return None
+    try:
+        return _get_midas(_device(camera_params)).predict(image)
+    except NotImplementedError:
+        # placeholder, MiDaSDepth.predict must be implemented for a real depth map
+        return None
+
+# small-box stereo fallbacks since the last log line, reported at most once per second
+_stereo_fallbacks = 0
+_stereo_fallbacks_since = time.monotonic()
+
+def _count_stereo_fallbacks(n: int):
+    global _stereo_fallbacks, _stereo_fallbacks_since
+    _stereo_fallbacks += n
+    now = time.monotonic()
+    if now - _stereo_fallbacks_since >= 1.0:
+        logger.info("stereo: %d boxes below min_height_px used the pinhole estimate in the last %.1fs",
+                    _stereo_fallbacks, now - _stereo_fallbacks_since)
+        _stereo_fallbacks = 0
+        _stereo_fallbacks_since = now
+
+def _pinhole_context(camera_params: CameraParams, stereo_params: CameraParams) -> CameraParams:
+    # the stereo rig's focal length serves pinhole when camera_params has none
+    if camera_params is not None and camera_params.get("focal_length_px") is not None:
+        return camera_params
+    return stereo_params
+
+# per-bbox implementations, all called positionally with the same fixed signature
+# (bbox, bbox_height_px, class_name, camera_params, image, depth_map, disparity_map, stereo_params),
+# which is much cheaper per call than keyword arguments into a **kwargs catch-all;
+# camera_params and stereo_params are each a dict, a CameraContext or None
+
+def _pinhole_distance(bbox, bbox_height_px, class_name, camera_params, image, depth_map, disparity_map, stereo_params):
+    # type() check first: names are the common case and the isinstance below costs ~90 ns
+    if type(class_name) is not str and isinstance(class_name, (int, np.integer)) and camera_params is not None:
+        f = camera_params.get("focal_length_px")
+        if f is not None:
+            return pinhole_estimate_id(bbox_height_px, class_name, f)
+    return pinhole_estimate(bbox_height_px, object_class=class_name, camera_params=camera_params)
+
+def _bbox_distance(bbox, bbox_height_px, class_name, camera_params, image, depth_map, disparity_map, stereo_params):
+    return bbox_estimate(bbox_height_px, coeffs=_bbox_coeffs(camera_params))
+
+def _stereo_distance(bbox, bbox_height_px, class_name, camera_params, image, depth_map, disparity_map, stereo_params):
+    if disparity_map is None or stereo_params is None:
+        return float("inf")
+    focal_baseline, min_height_px = _stereo_focal_baseline(stereo_params)
+    if bbox_height_px < min_height_px:
+        _count_stereo_fallbacks(1)
+        return _pinhole_distance(bbox, bbox_height_px, class_name, _pinhole_context(camera_params, stereo_params),
+                                 image, depth_map, disparity_map, stereo_params)
+    return stereo_estimate(disparity_map, bbox, focal_baseline, method="median")
+
+def _midas_distance(bbox, bbox_height_px, class_name, camera_params, image, depth_map, disparity_map, stereo_params):
+    depth_map = _midas_depth_map(image, depth_map, camera_params)
+    if depth_map is None:
+        return float("inf")
+    return MiDaSDepth.median_depth_in_bbox(depth_map, bbox)
+
+_DISPATCH: Dict[Method, Callable[..., float]] = {
+    Method.PINHOLE: _pinhole_distance,
+    Method.BBOX: _bbox_distance,
+    Method.STEREO: _stereo_distance,
+    Method.MIDAS: _midas_distance,
+}
+
+# batched implementations, (N,4) boxes and (N,) heights in, (N,) distances out
+
+def _pinhole_distances(boxes, heights, *, object_classes, camera_params, **_):
+    if object_classes is None:
+        object_classes = ["person"] * boxes.shape[0]
+    return pinhole_estimate_batch(heights, object_classes, camera_params=camera_params)
+
+def _bbox_distances(boxes, heights, *, camera_params, **_):
+    return bbox_estimate_batch(heights, coeffs=_bbox_coeffs(camera_params))
+
+def _stereo_distances(boxes, heights, *, object_classes, camera_params, disparity_map, stereo_params, **_):
+    if disparity_map is None or stereo_params is None:
+        return np.full(boxes.shape[0], np.inf)
+    focal_baseline, min_height_px = _stereo_focal_baseline(stereo_params)
+    small = heights < min_height_px
+    if not small.any():
+        return stereo_estimate_batch(disparity_map, boxes, focal_baseline)
+    _count_stereo_fallbacks(int(np.count_nonzero(small)))
+    out = np.empty(boxes.shape[0])
+    if object_classes is not None:
+        object_classes = (object_classes[small] if isinstance(object_classes, np.ndarray)
+                          else [object_classes[i] for i in np.flatnonzero(small)])
+    out[small] = _pinhole_distances(boxes[small], heights[small], object_classes=object_classes,
+                                    camera_params=_pinhole_context(camera_params, stereo_params))
+    large = ~small
+    out[large] = stereo_estimate_batch(disparity_map, boxes[large], focal_baseline)
+    return out
+
+def _midas_distances(boxes, heights, *, image, depth_map, camera_params, **_):
+    depth_map = _midas_depth_map(image, depth_map, camera_params)
+    if depth_map is None:
+        return np.full(boxes.shape[0], np.inf)
+    return MiDaSDepth.median_depth_in_bboxes(depth_map, boxes)
+
+_BATCH_DISPATCH: Dict[Method, Callable[..., np.ndarray]] = {
+    Method.PINHOLE: _pinhole_distances,
+    Method.BBOX: _bbox_distances,
+    Method.STEREO: _stereo_distances,
+    Method.MIDAS: _midas_distances,
+}
 
 def estimate_distance_for_bbox(method: str, bbox: Tuple[int,int,int,int], *,
                                image=None,  # needed for some methods like MiDaS
-                               class_name: str = "person",
-                               camera_params: Dict = None,
+                               depth_map=None,
+                               class_name: Union[str, int] = "person",
+                               camera_params: CameraParams = None,
                                bbox_height_px: float = None,
                                disparity_map=None,
-                               stereo_params: Dict = None) -> float:
+                               stereo_params: CameraParams = None) -> float:
     """
     Unified function to estimate distance for a single bounding box.
 
     Args:
-        method: 'pinhole', 'bbox', 'stereo', 'midas'
+        method: 'pinhole', 'bbox', 'stereo', 'midas' (or a Method member)
         bbox: (x1,y1,x2,y2)
-        image: full image (required for midas)
-        class_name: object class (used by pinhole)
-        camera_params: dict with keys like 'focal_length_px'
+        image: full image (required for midas unless depth_map is given)
+        depth_map: MiDaS depth map of image, to reuse one inference across the boxes
+                   of a frame (optional)
+        class_name: object class (used by pinhole), or its int pinhole OBJECT_CLASS_IDS id
+        camera_params: dict with keys like 'focal_length_px', or a CameraContext
         bbox_height_px: precomputed bbox height in pixels (optional)
         disparity_map: for stereo method
-        stereo_params: dict with 'focal_length_px', 'baseline_m'
+        stereo_params: dict with 'focal_length_px', 'baseline_m', or a CameraContext;
+                       boxes shorter than its 'min_height_px' (default MIN_STEREO_HEIGHT_PX)
+                       get the pinhole estimate instead of a stereo one; 'disparity_scale'
+                       (default 1.0) reads fixed-point maps, e.g. 256.0 for KITTI uint16
 
     Returns:
         distance in meters (float). inf on failure.
     """
-    x1,y1,x2,y2 = bbox
     if bbox_height_px is None:
-        bbox_height_px = max(1, y2 - y1)
-
-    if method == "pinhole":
+        bbox_height_px = max(1, bbox[3] - bbox[1])
+    # the plain pinhole call is the hottest case; skip the table and the extra frame
+    if method == "pinhole" and type(class_name) is str:
         return pinhole_estimate(bbox_height_px, object_class=class_name, camera_params=camera_params)
-    elif method == "bbox":
-        coeffs = camera_params.get("bbox_coeffs") if camera_params else None
-        if coeffs is None:
-            from distance_methods.bbox_pixel_method import DEFAULT_COEFFS
-            coeffs = DEFAULT_COEFFS
-        return bbox_estimate(bbox_height_px, coeffs=coeffs)
-    elif method == "stereo":
-        if disparity_map is None or stereo_params is None:
-            return float("inf")
-        focal = stereo_params.get("focal_length_px")
-        baseline = stereo_params.get("baseline_m")
-        from distance_methods.stereo_depth import estimate_bbox_depth
-        return estimate_bbox_depth(disparity_map, bbox, focal, baseline, method="median")
-    elif method == "midas":
-        # placeholder, user must construct MiDaSDepth and call predict
-        try:
-            from distance_methods.midas_depth import MiDaSDepth
-            model = MiDaSDepth(device=camera_params.get("device","cpu"))
-            depth_map = model.predict(image)
-            return MiDaSDepth.median_depth_in_bbox(depth_map, bbox)
-        except Exception:
-            return float("inf")
-    else:
+    fn = _DISPATCH.get(method)
+    if fn is None:
+        raise ValueError(f"Unknown distance estimation method: {method}")
+    return fn(bbox, bbox_height_px, class_name, camera_params, image, depth_map, disparity_map, stereo_params)
+
+
+def estimate_distance_for_bboxes(method: str, bboxes, *,
+                                 image=None,
+                                 depth_map=None,
+                                 object_classes=None,
+                                 camera_params: CameraParams = None,
+                                 disparity_map=None,
+                                 stereo_params: CameraParams = None) -> np.ndarray:
+    """
+    Batched estimate_distance_for_bbox for the N detections of one frame.
+
+    Args:
+        method: 'pinhole', 'bbox', 'stereo', 'midas' (or a Method member)
+        bboxes: (N,4) array of (x1,y1,x2,y2)
+        object_classes: N class names, or N int pinhole OBJECT_CLASS_IDS (array or list)
+                        (used by pinhole and small stereo boxes; default: all 'person')
+        image, depth_map, camera_params, disparity_map, stereo_params: as in estimate_distance_for_bbox
+
+    Returns:
+        (N,) array of distances in meters, inf on failure.
+    """
+    fn = _BATCH_DISPATCH.get(method)
+    if fn is None:
         raise ValueError(f"Unknown distance estimation method: {method}")
+    boxes = np.asarray(bboxes, dtype=float).reshape(-1, 4)
+    heights = np.maximum(boxes[:, 3] - boxes[:, 1], 1)
+    return fn(boxes, heights, image=image, depth_map=depth_map, object_classes=object_classes, camera_params=camera_params,
+              disparity_map=disparity_map, stereo_params=stereo_params)
@@ -3,10 +3,17 @@ Quick test script to validate methods (non-exhaustive).
 Run: python src/test_distance_methods.py
 """
 
+import ctypes
 import numpy as np
 from distance_methods.pinhole_method import focal_length_px_from_fov, estimate_distance as pinhole
+from distance_methods.pinhole_method import estimate_distance_batch as pinhole_batch, OBJECT_CLASS_IDS
+from distance_methods.pinhole_method import estimate_distance_id as pinhole_id
 from distance_methods.bbox_pixel_method import fit_model, estimate_distance as bbox_est
-from distance_methods.stereo_depth import disparity_to_depth
+from distance_methods.bbox_pixel_method import estimate_distance_batch as bbox_batch
+from distance_methods.stereo_depth import disparity_to_depth, estimate_bbox_depth, estimate_bboxes_depth, KITTI_DISPARITY_SCALE
+from distance_methods.midas_depth import MiDaSDepth
+from distance_methods._kernels import pinhole_batch_c
+from distance_estimation import CameraContext, estimate_distance_for_bbox, estimate_distance_for_bboxes
 
 def test_pinhole():
     # suppose image height 720, vfov 49 deg -> compute f
@@ -24,13 +31,119 @@ def test_bbox_fit():
     print("Fitted coeffs:", a, b)
     print("Estimate for 200 px:", bbox_est(200, coeffs=(a,b)))
 
+def test_batch():
+    # batched estimates must match the scalar ones, inf for degenerate boxes
+    f = focal_length_px_from_fov(720, 49.0)
+    camera_params = {"focal_length_px": f}
+    heights = np.array([200, 120, 0, 80], dtype=float)
+    classes = ["person", "car", "truck", "bicycle"]
+    expected = [pinhole(h, object_class=c, camera_params=camera_params) for h, c in zip(heights, classes)]
+    assert np.allclose(pinhole_batch(heights, classes, camera_params=camera_params), expected)
+    class_ids = np.array([OBJECT_CLASS_IDS.get(c, OBJECT_CLASS_IDS["person"]) for c in classes])
+    assert np.allclose(pinhole_batch(heights, class_ids, camera_params=camera_params), expected)
+    assert np.allclose(pinhole_batch(heights, class_ids.tolist(), camera_params=camera_params), expected)
+    # ids outside the table count as 'person', like unknown names
+    person = [pinhole(h, object_class="person", camera_params=camera_params) for h in heights]
+    assert np.allclose(pinhole_batch(heights, [-1, 4, 7, 99], camera_params=camera_params), person)
+    assert np.allclose([pinhole_id(h, i, f) for h, i in zip(heights, [-1, 4, 7, 99])], person)
+    assert np.allclose([pinhole_id(h, int(i), f) for h, i in zip(heights, class_ids)], expected)
+    # detector class tensors are float: integral floats are ids, anything else is an error
+    assert np.allclose(pinhole_batch(heights, class_ids.astype(np.float32), camera_params=camera_params), expected)
+    assert np.allclose(pinhole_batch(heights, [float(i) for i in class_ids], camera_params=camera_params), expected)
+    assert np.allclose(pinhole_batch(heights, [-1.0, 4.0, 7.0, 1e300], camera_params=camera_params), person)
+    for bad in ([0.5, 1.0, 2.0, 3.0], [np.nan, 1.0, 2.0, 3.0], [True, False, True, False]):
+        try:
+            pinhole_batch(heights, bad, camera_params=camera_params)
+        except TypeError:
+            pass
+        else:
+            raise AssertionError("accepted class ids %r" % (bad,))
+    expected = [bbox_est(h, coeffs=(450.0, 0.5)) for h in heights]
+    assert np.allclose(bbox_batch(heights, coeffs=(450.0, 0.5)), expected)
+    print("Batch estimates:", pinhole_batch(heights, classes, camera_params=camera_params))
+
+def test_pinhole_c_abi():
+    # the C entry point must match the NumPy batch; skipped without numba
+    if pinhole_batch_c is None:
+        return
+    heights = np.array([200, 120, 0, 80], dtype=np.float64)
+    class_ids = np.array([0, 1, 2, 3], dtype=np.int32)
+    out = np.empty(4)
+    pinhole_batch_c.ctypes(heights.ctypes.data_as(ctypes.POINTER(ctypes.c_double)),
+                           class_ids.ctypes.data_as(ctypes.POINTER(ctypes.c_int32)), 4, 800.0,
+                           out.ctypes.data_as(ctypes.POINTER(ctypes.c_double)))
+    assert np.allclose(out, pinhole_batch(heights, class_ids, camera_params={"focal_length_px": 800.0}))
+    unknown = np.array([-1, 7, 99, 4], dtype=np.int32)
+    pinhole_batch_c.ctypes(heights.ctypes.data_as(ctypes.POINTER(ctypes.c_double)),
+                           unknown.ctypes.data_as(ctypes.POINTER(ctypes.c_int32)), 4, 800.0,
+                           out.ctypes.data_as(ctypes.POINTER(ctypes.c_double)))
+    assert np.allclose(out, pinhole_batch(heights, unknown, camera_params={"focal_length_px": 800.0}))
+    print("Pinhole C ABI:", out)
+
 def test_stereo():
     f_px = 1200.0
     baseline_m = 0.12
     disp = 60.0
     print("Stereo depth:", disparity_to_depth(disp, f_px, baseline_m))
+    disp_map = np.array([[60.0, 0.0], [-1.0, 30.0]], dtype=np.float32)
+    depth_map = disparity_to_depth(disp_map, f_px, baseline_m)
+    assert np.allclose(depth_map, [[2.4, np.inf], [np.inf, 4.8]])
+    print("Stereo depth map:", depth_map)
+    # uint16 maps are plain pixels unless a fixed-point scale is given, the same in every entry point
+    raw = np.full((4, 4), 2560, dtype=np.uint16)
+    for scale, expected in ((1.0, 100.0 / 2560), (KITTI_DISPARITY_SCALE, 10.0)):
+        assert np.allclose(disparity_to_depth(raw, 100.0, 1.0, disparity_scale=scale), expected)
+        assert np.isclose(estimate_bbox_depth(raw, (0, 0, 3, 3), 100.0, 1.0, disparity_scale=scale), expected)
+        assert np.allclose(estimate_bboxes_depth(raw, [[0, 0, 3, 3]], 100.0, 1.0, disparity_scale=scale), expected)
+
+def test_midas_medians():
+    # batched bbox medians must match the per-bbox ones, including the strided large-box case
+    rng = np.random.default_rng(1)
+    depth_map = rng.uniform(1.0, 20.0, size=(480, 640)).astype(np.float32)
+    depth_map[0:40, 0:40] = np.nan
+    bboxes = np.array([[10, 20, 60, 220], [-5, -5, 30, 30], [0, 0, 639, 479], [5, 5, 5, 5], [600, 400, 700, 500]])
+    batch = MiDaSDepth.median_depth_in_bboxes(depth_map, bboxes)
+    single = [MiDaSDepth.median_depth_in_bbox(depth_map, tuple(b)) for b in bboxes]
+    assert np.allclose(batch, single, equal_nan=True)
+    print("MiDaS bbox medians:", batch)
+    # a caller-supplied depth map skips inference, and a reused frame buffer gets the new map
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    for dm in (depth_map, depth_map + 1.0):
+        via_dispatch = estimate_distance_for_bboxes("midas", bboxes, image=frame, depth_map=dm)
+        assert np.allclose(via_dispatch, MiDaSDepth.median_depth_in_bboxes(dm, bboxes), equal_nan=True)
+        assert np.isclose(estimate_distance_for_bbox("midas", tuple(bboxes[0]), image=frame, depth_map=dm),
+                          via_dispatch[0])
+
+def test_dispatch_batch():
+    # the batched dispatcher must agree with the per-bbox one
+    rng = np.random.default_rng(0)
+    disparity_map = rng.uniform(-2.0, 64.0, size=(480, 640))
+    bboxes = np.array([[10, 20, 60, 220], [300, 100, 340, 180], [600, 400, 700, 500], [5, 5, 5, 5]])
+    kwargs = {
+        "camera_params": {"focal_length_px": focal_length_px_from_fov(480, 49.0)},
+        "disparity_map": disparity_map,
+        "stereo_params": {"focal_length_px": 1200.0, "baseline_m": 0.12},
+    }
+    for method in ("pinhole", "bbox", "stereo"):
+        batch = estimate_distance_for_bboxes(method, bboxes, **kwargs)
+        single = [estimate_distance_for_bbox(method, tuple(b), **kwargs) for b in bboxes]
+        assert np.allclose(batch, single), method
+        bound = {k: CameraContext.from_dict(v) if k.endswith("_params") else v for k, v in kwargs.items()}
+        assert np.allclose(estimate_distance_for_bboxes(method, bboxes, **bound), batch), method
+        print(f"Batched {method}:", batch)
+    # the 0 px box is below min_height_px, so stereo falls back to pinhole with camera_params' focal length
+    pinhole_fallback = pinhole(1, camera_params=kwargs["camera_params"])
+    assert np.isclose(estimate_distance_for_bboxes("stereo", bboxes, **kwargs)[-1], pinhole_fallback)
+    # without camera_params the fallback uses the stereo focal length
+    stereo_only = {"disparity_map": disparity_map, "stereo_params": kwargs["stereo_params"]}
+    assert np.isclose(estimate_distance_for_bboxes("stereo", bboxes, **stereo_only)[-1], 1.7 * 1200.0 / 1)
+    assert np.isclose(estimate_distance_for_bbox("stereo", tuple(bboxes[-1]), **stereo_only), 1.7 * 1200.0 / 1)
 
 if __name__ == "__main__":
     test_pinhole()
     test_bbox_fit()
+    test_batch()
+    test_pinhole_c_abi()
     test_stereo()
+    test_midas_medians()
+    test_dispatch_batch()